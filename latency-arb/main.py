@@ -1,36 +1,48 @@
+import numpy as np
+
 from signal_processing import load_all as signal
+from trade_engine import TradeEngine
 from util import *
 
-# extract_all_tar(TAR_FILE_PATH, GZ_DIR)
-data = extract_all_gz(GZ_DIR)
-signal_dict = signal(data, threshold=50, latency=10, transaction_fee=50)
+# Worker processes re-import this module, so the pipeline only runs as a script
+if __name__ == "__main__":
+    # extract_all_tar(TAR_FILE_PATH, GZ_DIR)
+    data = extract_all_gz(GZ_DIR)
+    signal_dict = signal(data, threshold=50, latency=10, transaction_fee=50)
 
-print(signal_dict)
+    print(signal_dict)
 
-engine = TradeEngine(transaction_fee=0.50)
-latest_prices = {}
+    engine = TradeEngine(transaction_fee=0.50)
+    latest_prices = {}
 
-for current_df in real_time_feed(df):
-    current_row = current_df.iloc[-1]
-    timestamp = current_row.name
+    price_a_arr = df[('Price', 'A')].to_numpy()
+    price_b_arr = df[('Price', 'B')].to_numpy()
+    idx = df.index.to_numpy()
 
-    # Update latest prices from current_row
+    # Example strategy: market making or latency arb, evaluated for every row at once.
     # Detect opportunity: if spread > threshold and quantity > threshold
     # Use a simplified condition for now
-    bid = current_row[('Price', 'B')]
-    ask = current_row[('Price', 'A')]
-
-    # Example strategy: market making or latency arb
-    if ask < some_other_exchange_bid:
-        # Opportunity to buy on A, sell on B
-        engine.enter_trade(price=ask, direction='long')
-    elif bid > some_other_exchange_ask:
-        # Opportunity to sell on A, buy on B
-        engine.enter_trade(price=bid, direction='short')
-
-    # Add exit condition
-    # (e.g., price reverts, or fixed number of rows later)
-    # Then:
-    # engine.exit_trade(current_price)
-
-    print(f"[{timestamp}] Current PnL: {engine.current_pnl(current_price)}")
\ No newline at end of file
+    # Opportunity to buy on A, sell on B
+    enter_long_mask = price_a_arr < some_other_exchange_bid
+    # Opportunity to sell on A, buy on B
+    enter_short_mask = ~enter_long_mask & (price_b_arr > some_other_exchange_ask)
+    trade_signal = enter_long_mask.view(np.int8) - enter_short_mask.view(np.int8)
+
+    # The engine state only changes where the signal does, so replay just those rows
+    for i in np.flatnonzero(np.diff(trade_signal, prepend=0)):
+        timestamp = idx[i]
+        bid = price_b_arr[i]
+        ask = price_a_arr[i]
+
+        if trade_signal[i] == 1:
+            engine.enter_trade(price=ask, direction='long')
+        elif trade_signal[i] == -1:
+            engine.enter_trade(price=bid, direction='short')
+
+        # Add exit condition
+        # (e.g., price reverts, or fixed number of rows later)
+        # Then:
+        # engine.exit_trade(current_price)
+
+        # PnL is logged at these signal changes only, not for every row
+        print(f"[{timestamp}] Current PnL: {engine.current_pnl(current_price)}")
\ No newline at end of file
@@ -1,7 +1,23 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial, wraps
+
 import pandas as pd
 import numpy as np
+import polars as pl
+from numba import njit
 from tqdm import tqdm
 
+from util import scan_quotes
+
+
+def _call(f, args, kwargs, df):
+    # Binds the extra arguments after the DataFrame, which functools.partial cannot do
+    return f(df, *args, **kwargs)
+
+
 def apply_to_data(func):
     """
     A decorator to apply a function to either a dictionary of DataFrames or a single DataFrame.
@@ -12,10 +28,29 @@ def apply_to_data(func):
     Returns:
         function: A wrapped function that can handle both dictionaries and single DataFrames.
     """
+    @wraps(func)
     def wrapper(data, *args, **kwargs):
-        if isinstance(data, dict):
-            # Apply the function to each DataFrame in the dictionary
-            return {key: func(df, *args, **kwargs) for key, df in tqdm(data.items(), desc="Processing DataFrames")}
+        if isinstance(data, dict) and len(data) > 1:
+            # Apply the function to each DataFrame in the dictionary, one worker process per DataFrame.
+            # The wrapper is submitted rather than func, as only the module-level name can be pickled.
+            # Workers are spawned, as forking after Polars has started its thread pool can deadlock.
+            n_workers = min(len(data), os.cpu_count() or 1)
+            # Split the cores between the workers and their Polars thread pools. Spawned workers
+            # inherit the environment and read it when importing polars.
+            polars_threads = os.environ.get('POLARS_MAX_THREADS')
+            os.environ['POLARS_MAX_THREADS'] = str(max(1, (os.cpu_count() or 1) // n_workers))
+            try:
+                with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    results = executor.map(partial(_call, wrapper, args, kwargs), data.values())
+                    return dict(zip(data.keys(), tqdm(results, total=len(data), desc="Processing DataFrames")))
+            finally:
+                if polars_threads is None:
+                    os.environ.pop('POLARS_MAX_THREADS', None)
+                else:
+                    os.environ['POLARS_MAX_THREADS'] = polars_threads
+        elif isinstance(data, dict):
+            # A single DataFrame is not worth the pool start-up
+            return {key: func(df, *args, **kwargs) for key, df in data.items()}
         else:
             # Apply the function to a single DataFrame
             return func(data, *args, **kwargs)
@@ -23,58 +58,235 @@ def apply_to_data(func):
 
 
 @apply_to_data
-def load_all(df, threshold=50, latency=10, transaction_fee=50):
-    df = filter_trading_hours(df)
-    df = filter_na_exchange(df)
-    df = filter_actions(df)
+def load_all(source, threshold=50, latency=10, transaction_fee=50):
+    # Files listed by extract_all_gz are scanned here, so cold caches are built in the workers
+    lf = scan_quotes(source) if isinstance(source, str) else source
+    # Filtering runs as a single streaming query, only the kept rows reach pandas
+    df = (
+        filter_rows(lf)
+        .with_columns(pl.col('Exchange', 'Action').cast(pl.Categorical))
+        .collect(engine='streaming')
+        .to_pandas()
+    )
     df = reshape_bid_ask_data(df)
-    return process_signals(df, threshold=threshold, latency=latency, transaction_fee=transaction_fee)
+    ticks = to_tick_arrays(df)
+    return process_signals(ticks, threshold=threshold, latency=latency, transaction_fee=transaction_fee)
 
 
 @apply_to_data
-def filter_trading_hours(df):
-    """Filters rows within trading hours (9:30 AM to 4:00 PM)."""
+def filter_rows(lf, action_type="FQ"):
+    """
+    Filters rows of the lazily scanned quotes, keeping those within trading hours (9:30 AM to 4:00 PM),
+    with a non-null 'Exchange' and whose action matches the action type, defaulting to "FQ" as in FirmQuote.
+    The predicates are fused into one filter that Polars pushes down into the Feather (or CSV) scan.
+    """
     market_open = 93000000  # 9:30 AM
     market_close = 160000000  # 4:00 PM
-    return df[(df['Timestamp'] >= market_open) & (df['Timestamp'] <= market_close)]
+    return lf.filter(
+        pl.col('Timestamp').is_between(market_open, market_close)
+        & pl.col('Exchange').is_not_null()
+        & pl.col('Action').str.contains(action_type)
+    )
 
 
 @apply_to_data
-def filter_na_exchange(df):
-    """Filters rows where 'Exchange' is NaN."""
-    return df[~df['Exchange'].isna()]
+def reshape_bid_ask_data(df):
+    """
+    Reshapes the DataFrame to pivot bid and ask data for easier analysis.
+    """
+    df = df.drop(columns=['Date']).assign(Side=pd.Categorical(df['Side'], categories=['A', 'B']))
+    pivoted_df = df.set_index(['Timestamp', 'Side']).groupby(level=[0, 1], observed=True).first().unstack('Side')
+    pivoted_df[('Price', 'A')] *= -1
+    return pivoted_df
 
 
-@apply_to_data
-def filter_actions(df, action_type = "FQ"):
+@njit(cache=True)
+def _segment_starts(current_ex, ex_a, ex_b):
+    """
+    Returns the first row of each run of consecutive rows quoted by the same exchange.
+    A run started on exchange e lasts until the first row where neither side is quoted by e.
+    """
+    starts = np.empty(len(current_ex), dtype=np.int64)
+    n_starts = 0
+    ex = -1
+    for i in range(len(current_ex)):
+        if n_starts == 0 or (ex_a[i] != ex and ex_b[i] != ex):
+            starts[n_starts] = i
+            n_starts += 1
+            ex = current_ex[i]
+    return starts[:n_starts]
+
+
+@njit(cache=True)
+def _max_other_bid(latest_price_arr, order, n_seen, ex):
+    """
+    Returns the highest latest bid and its exchange among the exchanges other than `ex`.
+    As with max() over the former latest_price dictionary, a leading NaN masks every later price.
+    """
+    stale_price = np.nan
+    stale_exchange = -1
+    for m in range(n_seen):
+        other = order[m]
+        if other != ex and (stale_exchange < 0 or latest_price_arr[other, 1] > stale_price):
+            stale_price = latest_price_arr[other, 1]
+            stale_exchange = other
+    return stale_price, stale_exchange
+
+
+@njit(cache=True)
+def _min_other_ask(latest_price_arr, order, n_seen, ex):
+    """
+    Returns the lowest latest (negated) ask and its exchange among the exchanges other than `ex`.
+    As with min() over the former latest_price dictionary, a leading NaN masks every later price.
+    """
+    stale_price = np.nan
+    stale_exchange = -1
+    for m in range(n_seen):
+        other = order[m]
+        if other != ex and (stale_exchange < 0 or latest_price_arr[other, 0] < stale_price):
+            stale_price = latest_price_arr[other, 0]
+            stale_exchange = other
+    return stale_price, stale_exchange
+
+
+@njit(cache=True)
+def _record_signal(out_idx, out_val, n_out, k, side, current_price, stale_price, stale_exchange, sum_q, fee):
     """
-    Filters rows based on the action type, defaulting to "FQ" as in FirmQuote.
+    Writes the signal to the output buffers if the price difference is greater than the transaction fee.
+    Returns the updated number of signals.
     """
-    return df[df['Action'].str.contains(action_type, na=False)]
+    if not np.isnan(stale_price) and current_price + stale_price > fee:
+        out_idx[n_out, 0] = k
+        out_idx[n_out, 1] = side
+        out_idx[n_out, 2] = stale_exchange
+        out_val[n_out, 0] = current_price + stale_price - fee
+        out_val[n_out, 1] = sum_q
+        n_out += 1
+    return n_out
+
+
+@njit(cache=True)
+def _scan(starts, ends, current_ex, price_a, price_b, sums_q_a, sums_q_b, n_ex,
+          threshold, latency, transaction_fee, out_idx, out_val):
+    """
+    Scans the exchange segments and records every exploitable price difference.
+
+    Parameters:
+        starts, ends (np.ndarray): First and last row of each segment.
+        current_ex (np.ndarray): Exchange code of every row.
+        price_a, price_b (np.ndarray): Ask (negated) and bid price of every row.
+        sums_q_a, sums_q_b (np.ndarray): Total quantity of each segment per side.
+        n_ex (int): The number of distinct exchange codes.
+        threshold, latency, transaction_fee: See `process_signals`.
+        out_idx (np.ndarray): int64[2 * n_segments, 3] buffer receiving (segment, side, stale exchange).
+        out_val (np.ndarray): float64[2 * n_segments, 2] buffer receiving (profit, quantity).
+
+    Returns:
+        int: The number of signals written to the output buffers.
+    """
+    # Latest price per exchange for sides A (0) and B (1)
+    latest_price_arr = np.full((n_ex, 2), np.nan)
+    # Exchanges in order of first appearance, so that stale prices are picked
+    # in the same order as the former latest_price dictionary
+    order = np.empty(n_ex, dtype=np.int64)
+    seen = np.zeros(n_ex, dtype=np.bool_)
+    n_seen = 0
+    # Stale quote lookups are memoized per (exchange, side) and reused until
+    # the price column they read from changes
+    version = np.zeros(2, dtype=np.int64)
+    cached_version = np.full((n_ex, 2), -1, dtype=np.int64)
+    cached_price = np.empty((n_ex, 2))
+    cached_exchange = np.empty((n_ex, 2), dtype=np.int64)
+    n_out = 0
+    fee = transaction_fee / 100
+
+    for k in range(len(starts)):
+        signal_start = starts[k]
+        signal_end = ends[k]
+        ex = current_ex[signal_start]
+        if not seen[ex]:
+            seen[ex] = True
+            order[n_seen] = ex
+            n_seen += 1
+            version += 1
+        for side in range(2):
+            price = price_a[signal_start] if side == 0 else price_b[signal_start]
+            if not np.isnan(price) and price != latest_price_arr[ex, side]:
+                latest_price_arr[ex, side] = price
+                version[side] += 1
+
+        # Check if latency is viable
+        if signal_end - signal_start < latency:
+            continue
+
+        # Identify the side of the purchase pressure, A before B.
+        # A: other side should have a high enough sell price for the price
+        # difference to be exploitable; B: vice versa.
+        if sums_q_a[k] >= threshold:
+            if cached_version[ex, 0] != version[1]:
+                cached_price[ex, 0], cached_exchange[ex, 0] = _max_other_bid(latest_price_arr, order, n_seen, ex)
+                cached_version[ex, 0] = version[1]
+            n_out = _record_signal(out_idx, out_val, n_out, k, 0, price_a[signal_end],
+                                   cached_price[ex, 0], cached_exchange[ex, 0], sums_q_a[k], fee)
+        if sums_q_b[k] >= threshold:
+            if cached_version[ex, 1] != version[0]:
+                cached_price[ex, 1], cached_exchange[ex, 1] = _min_other_ask(latest_price_arr, order, n_seen, ex)
+                cached_version[ex, 1] = version[0]
+            n_out = _record_signal(out_idx, out_val, n_out, k, 1, price_b[signal_end],
+                                   cached_price[ex, 1], cached_exchange[ex, 1], sums_q_b[k], fee)
+    return n_out
+
+
+@dataclass
+class TickArrays:
+    """
+    Column-wise NumPy view of the reshaped bid/ask data, one entry per timestamp.
+
+    Exchanges of both sides are encoded as int32 codes into `exchanges` (-1 for NaN),
+    prices and quantities are float64 with NaN where a side is not quoted.
+    """
+    timestamp: np.ndarray
+    exchanges: np.ndarray
+    exchange_a: np.ndarray
+    exchange_b: np.ndarray
+    price_a: np.ndarray
+    price_b: np.ndarray
+    quantity_a: np.ndarray
+    quantity_b: np.ndarray
+
+    def __len__(self):
+        return len(self.timestamp)
 
 
 @apply_to_data
-def reshape_bid_ask_data(df):
+def to_tick_arrays(df):
     """
-    Reshapes the DataFrame to pivot bid and ask data for easier analysis.
+    Converts the reshaped bid/ask DataFrame into contiguous column arrays for `process_signals`.
     """
-    pivoted_df = df.pivot_table(
-    index=['Timestamp'],
-    columns='Side',
-        values=[col for col in df.columns if col not in ['Date', 'Timestamp', 'Side']],
-        aggfunc='first'
-)
-    pivoted_df[('Price', 'A')] = pivoted_df[('Price', 'A')] * (-1)
-    return pivoted_df
+    n = len(df)
+    codes, exchanges = pd.factorize(
+        np.concatenate([df[('Exchange', 'A')].to_numpy(), df[('Exchange', 'B')].to_numpy()])
+    )
+    codes = codes.astype(np.int32)
+    return TickArrays(
+        timestamp=df.index.to_numpy(),
+        exchanges=np.asarray(exchanges, dtype=object),
+        exchange_a=codes[:n],
+        exchange_b=codes[n:],
+        price_a=df[('Price', 'A')].to_numpy(dtype=np.float64),
+        price_b=df[('Price', 'B')].to_numpy(dtype=np.float64),
+        quantity_a=df[('Quantity', 'A')].to_numpy(dtype=np.float64),
+        quantity_b=df[('Quantity', 'B')].to_numpy(dtype=np.float64),
+    )
 
 
 @apply_to_data
-def process_signals(df, threshold=50, latency=10, transaction_fee=50):
+def process_signals(ticks, threshold=50, latency=10, transaction_fee=50):
     """
     Processes trading signals by identifying exploitable price differences based on bid/ask data.
 
     Parameters:
-        df (pd.DataFrame): The input DataFrame containing trading data.
+        ticks (TickArrays): The input bid/ask data, see `to_tick_arrays`.
         threshold (int): The minimum quantity threshold for a valid signal.
         latency (int): The minimum duration (in rows) for a valid signal.
         transaction_fee (float): The transaction fee per contract.
@@ -84,95 +296,37 @@ def process_signals(df, threshold=50, latency=10, transaction_fee=50):
     """
     # Initialize variables
     ex_dict = {}
-    latest_price = {}
-    exchange_a = df[('Exchange', 'A')]
-    exchange_b = df[('Exchange', 'B')]
-    price_a = df[('Price', 'A')]
-    price_b = df[('Price', 'B')]
-    quantity_a = df[('Quantity', 'A')]
-    quantity_b = df[('Quantity', 'B')]
-
-    def get_signal(signal_start, signal_end, signal_side, sum_q, current_ex, latest_price):
-        """
-        Identifies if there is an exploitable price difference based on the signal side and other side prices.
-
-        Parameters:
-            signal_start (int): The starting index of the signal.
-            signal_end (int): The ending index of the signal.
-            signal_side (str): The side of the signal ('A' or 'B').
-            sum_q (float): The total quantity for the signal side.
-            current_ex (str): The current exchange.
-            latest_price (dict): A dictionary of the latest prices for each exchange and side.
-
-        Returns:
-            dict: A dictionary containing the signal details if exploitable, otherwise an empty dictionary.
-        """
-        other_side = 'B' if signal_side == 'A' else 'A'
-        other_side_price = {
-            key: latest_price[key]
-            for key in latest_price
-            if key[1] == other_side and key[0] != current_ex
-        }
+    n = len(ticks)
+    index = ticks.timestamp
+    exchanges = ticks.exchanges
+    ex_a, ex_b = ticks.exchange_a, ticks.exchange_b
+    price_a, price_b = ticks.price_a, ticks.price_b
+    quantity_a, quantity_b = ticks.quantity_a, ticks.quantity_b
+    current_ex = np.where(ex_b < 0, ex_a, ex_b)
+    if n == 0:
+        return ex_dict
 
-        # Check if latency is viable
-        if signal_end - signal_start >= latency:
-            current_price = df[('Price', signal_side)].iloc[signal_end]
-            if signal_side == 'A':
-                # Other side should have a high enough sell price for price difference to be exploitable
-                stale_price = max(other_side_price.values(), default=np.nan)
-                stale_exchange = max(other_side_price, key=other_side_price.get, default=None)
-            else:
-                # Vice versa
-                stale_price = min(other_side_price.values(), default=np.nan)
-                stale_exchange = min(other_side_price, key=other_side_price.get, default=None)
-
-            # Check if the price difference is greater than the transaction fee
-            if not np.isnan(stale_price) and current_price + stale_price > transaction_fee / 100:
-                key = (
-                    df.iloc[signal_start].name,
-                    df.iloc[signal_end].name,
-                    current_ex,
-                )
-                return {
-                    key: [
-                        signal_end - signal_start,
-                        current_price + stale_price - transaction_fee/100,
-                        sum_q,
-                        stale_exchange,
-                    ]
-                }
-        return {}
+    # Group consecutive rows by the same exchange
+    starts = _segment_starts(current_ex, ex_a, ex_b)
+    ends = np.r_[starts[1:], n] - 1
+
+    # Sum quantities per segment in a single pass
+    sums_q_a = np.add.reduceat(quantity_a, starts)
+    sums_q_b = np.add.reduceat(quantity_b, starts)
 
     # Main loop
-    i = 0
-    while i < len(df):
-        signal_start = i
-        current_ex = exchange_a.iloc[i] if pd.isna(exchange_b.iloc[i]) else exchange_b.iloc[i]
-        latest_price[(current_ex, 'A')] = price_a.iloc[i] if not pd.isna(price_a.iloc[i]) else latest_price.get((current_ex, 'A'), np.nan)
-        latest_price[(current_ex, 'B')] = price_b.iloc[i] if not pd.isna(price_b.iloc[i]) else latest_price.get((current_ex, 'B'), np.nan)
-        sum_q_a = 0
-        sum_q_b = 0
-
-        # Group consecutive rows by the same exchange
-        j = i
-        while j < len(df) and (exchange_a.iloc[j] == current_ex or exchange_b.iloc[j] == current_ex):
-            sum_q_a += quantity_a.iloc[j]
-            sum_q_b += quantity_b.iloc[j]
-            j += 1
-
-        # Marking the end of the signal
-        signal_end = j - 1
-
-        # Identify the side of the purchase pressure
-        if sum_q_a >= threshold and (pd.isna(sum_q_b) or sum_q_b < threshold):
-            ex_dict.update(get_signal(signal_start, signal_end, 'A', sum_q_a, current_ex, latest_price))
-        elif sum_q_b >= threshold and (pd.isna(sum_q_a) or sum_q_a < threshold):
-            ex_dict.update(get_signal(signal_start, signal_end, 'B', sum_q_b, current_ex, latest_price))
-        elif sum_q_a >= threshold and sum_q_b >= threshold:
-            ex_dict.update(get_signal(signal_start, signal_end, 'A', sum_q_a, current_ex, latest_price))
-            ex_dict.update(get_signal(signal_start, signal_end, 'B', sum_q_b, current_ex, latest_price))
-
-        # Skip processed rows
-        i = j
+    out_idx = np.empty((2 * len(starts), 3), dtype=np.int64)
+    out_val = np.empty((2 * len(starts), 2), dtype=np.float64)
+    n_out = _scan(starts, ends, current_ex, price_a, price_b, sums_q_a, sums_q_b, len(exchanges),
+                  threshold, latency, transaction_fee, out_idx, out_val)
+
+    for (k, side, stale_exchange), (profit, sum_q) in zip(out_idx[:n_out].tolist(), out_val[:n_out].tolist()):
+        signal_start, signal_end = int(starts[k]), int(ends[k])
+        key = (
+            index[signal_start],
+            index[signal_end],
+            exchanges[current_ex[signal_start]],
+        )
+        ex_dict[key] = [signal_end - signal_start, profit, sum_q, (exchanges[stale_exchange], 'AB'[1 - side])]
 
     return ex_dict
@@ -1,5 +1,7 @@
 from settings import *
 
 def real_time_feed(df):
+    # Yield a cursor to the row that is the current state of the market at "now";
+    # the consumer reads it from column arrays hoisted out of its loop
     for i in range(len(df)):
-        yield df.iloc[:i+1]  # slice simulates current state of the market up to "now"
\ No newline at end of file
+        yield i
\ No newline at end of file
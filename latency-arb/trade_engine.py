@@ -1,4 +1,6 @@
 class TradeEngine:
+    __slots__ = ('position', 'entry_price', 'realized_pnl', 'transaction_fee')
+
     def __init__(self, transaction_fee=0.50):
         self.position = 0
         self.entry_price = None
@@ -17,7 +19,8 @@ class TradeEngine:
             self.entry_price = None
 
     def current_pnl(self, current_price):
-        if self.position == 0:
+        position = self.position
+        if position == 0:
             return self.realized_pnl
-        unrealized = (current_price - self.entry_price) * self.position
+        unrealized = (current_price - self.entry_price) * position
         return self.realized_pnl + unrealized
\ No newline at end of file
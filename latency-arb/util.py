@@ -1,7 +1,9 @@
+import glob
+import hashlib
 import os
+import re
 import tarfile
-import gzip
-import pandas as pd
+import polars as pl
 
 from settings import *
 
@@ -10,11 +12,59 @@ def extract_all_tar(TAR_FILE_PATH, GZ_DIR):
     with tarfile.open(TAR_FILE_PATH, 'r') as tar:
         tar.extractall(GZ_DIR)
 
+# Numeric columns are typed up front since schema inference only looks at the first rows
+SCHEMA_OVERRIDES = {
+    'Timestamp': pl.Int32,
+    'StrikePrice': pl.Float64,
+    'Price': pl.Float64,
+    'Quantity': pl.Int32,
+    'UnderBidPrice': pl.Float64,
+    'UnderAskPrice': pl.Float64,
+}
+# Part of every cache file name, so changing the overrides never serves a stale schema
+SCHEMA_TAG = hashlib.sha1(repr(sorted(SCHEMA_OVERRIDES.items())).encode()).hexdigest()[:8]
+
 def extract_all_gz(GZ_DIR):
+    """
+    Lists every gzipped CSV in GZ_DIR by file name. Nothing is read here,
+    each file is opened with `scan_quotes` by the worker that processes it.
+    """
     data = {}
     for file in os.listdir(GZ_DIR):
         if file.endswith('.gz'):
-            full_path = os.path.join(GZ_DIR, file)
-            with gzip.open(full_path, 'rt') as f:
-                data[file] = pd.read_csv(f)
-    return data
\ No newline at end of file
+            data[file] = os.path.join(GZ_DIR, file)
+    return data
+
+def scan_quotes(full_path):
+    """
+    Lazily scans a gzipped CSV through an uncompressed Arrow IPC (Feather) cache next to it.
+    A missing or outdated cache is first built from the whole CSV, which reads the file eagerly;
+    later runs memory-map the cache instead of decompressing and parsing the CSV again.
+    When the cache cannot be written, e.g. in a read-only directory, the CSV is scanned directly.
+    """
+    cache_path = f"{full_path[:-len('.gz')]}.{SCHEMA_TAG}.feather"
+    if not os.path.exists(cache_path) or os.path.getmtime(cache_path) < os.path.getmtime(full_path):
+        try:
+            write_feather_cache(full_path, cache_path)
+        except OSError:
+            return pl.scan_csv(full_path, schema_overrides=SCHEMA_OVERRIDES)
+        remove_stale_caches(full_path)
+    return pl.scan_ipc(cache_path)
+
+def remove_stale_caches(full_path):
+    # Caches written under another schema tag are full copies of the data that will never be read again
+    stem = full_path[:-len('.gz')]
+    for path in glob.glob(glob.escape(stem) + '.*.feather'):
+        tag = path[len(stem) + 1:-len('.feather')]
+        if tag != SCHEMA_TAG and re.fullmatch('[0-9a-f]{8}', tag):
+            os.remove(path)
+
+def write_feather_cache(full_path, cache_path):
+    tmp_path = cache_path + '.tmp'
+    try:
+        pl.scan_csv(full_path, schema_overrides=SCHEMA_OVERRIDES).sink_ipc(tmp_path, compression='uncompressed')
+        # Only a complete cache file is ever visible under its final name
+        os.replace(tmp_path, cache_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
\ No newline at end of file